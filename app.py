@@ -1,18 +1,39 @@
 # app.py
 # PDF → Audiobook Converter (No Billing, Python 3.9)
 # Uses Edge TTS (free, no API keys) with UK/US male/female voices.
-# Requires: streamlit, PyMuPDF, pydub, gTTS, edge-tts, and FFmpeg on PATH.
+# Requires: streamlit, PyMuPDF, pydub, gTTS, edge-tts, lameenc, numpy, and FFmpeg on PATH.
 
 import io
+import os
+import base64
+import re
+import time
+import queue
 import asyncio
-from typing import List
+import hashlib
+import tempfile
+import functools
+import itertools
+import urllib.request
+import weakref
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Callable, Deque, List, Optional, Tuple
 
+import lameenc
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
+from streamlit.runtime.uploaded_file_manager import UploadedFile
 import fitz  # PyMuPDF
 from pydub import AudioSegment
-from gtts import gTTS
+from gtts import gTTS, gTTSError
 import edge_tts
 
+from pdf_extract import extract_text_preserving_structure, normalize_page_range
+
 VOICE_KEYS = ["British Male", "British Female", "American Male", "American Female"]
 EDGE_VOICE_MAP = {
     "British Male": "en-GB-RyanNeural",
@@ -20,96 +41,90 @@ EDGE_VOICE_MAP = {
     "American Male": "en-US-GuyNeural",
     "American Female": "en-US-JennyNeural",
 }
+# edge-tts' default output format: audio-24khz-48kbitrate-mono-mp3
+EDGE_OUTPUT_FRAME_RATE = 24000
+EDGE_OUTPUT_CHANNELS = 1
+EDGE_OUTPUT_BITRATE_KBPS = 48
+EDGE_MAX_CONCURRENCY = 6  # parallel Edge TTS requests during export
+PIPELINE_QUEUE_SIZE = 4  # synthesized chunks buffered ahead of audio assembly
+EXPORT_POLL_SECONDS = 0.5  # how often the UI refreshes export progress
+TTS_CACHE_DIR = Path(os.environ.get("TTS_CACHE_DIR", Path(tempfile.gettempdir()) / "pdf_audiobook_tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_MB", "500")) * 1024 * 1024
 
 st.set_page_config(page_title="PDF → Audiobook Converter", page_icon="🎧", layout="centered")
 st.title("🎧 PDF → Audiobook Converter")
 st.caption("Edge TTS (UK/US × Male/Female), gTTS fallback. Page range, preview, and MP3 export included.")
 
-# ---------- PDF extraction (preserve headings & paragraphs heuristically) ----------
-def extract_text_preserving_structure(pdf_bytes: bytes, page_start: int = None, page_end: int = None) -> str:
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    n_pages = len(doc)
-    if page_start is None:
-        page_start = 1
-    if page_end is None or page_end > n_pages:
-        page_end = n_pages
-    page_start = max(1, page_start)
-    page_end = max(page_start, min(n_pages, page_end))
-
-    parts: List[str] = []
-    for pno in range(page_start - 1, page_end):
-        page = doc[pno]
-        pdata = page.get_text("dict")
-
-        spansizes = []
-        for block in pdata.get("blocks", []):
-            for line in block.get("lines", []):
-                for span in line.get("spans", []):
-                    size = span.get("size", 0)
-                    if size:
-                        spansizes.append(size)
-        header_threshold = (sorted(spansizes)[int(0.75 * len(spansizes))] if spansizes else 16.0)
-
-        page_parts: List[str] = []
-        for block in pdata.get("blocks", []):
-            text_buf = []
-            max_size = 0.0
-            for line in block.get("lines", []):
-                line_text = "".join(span.get("text", "") for span in line.get("spans", []))
-                line_text = line_text.replace("\r", "").strip()
-                if line_text:
-                    text_buf.append(line_text)
-                for span in line.get("spans", []):
-                    if span.get("size", 0) > max_size:
-                        max_size = span["size"]
-            if not text_buf:
-                continue
-
-            block_text = " ".join(text_buf).strip()
-            if not block_text:
-                continue
-
-            if max_size >= header_threshold and len(block_text) <= 120:
-                page_parts.append(f"# {block_text}")
-            else:
-                page_parts.append(block_text)
-
-        parts.append("\n\n".join(page_parts))
+# ---------- PDF extraction (see pdf_extract.py) ----------
+def close_cached_pdf() -> None:
+    st.session_state.pop("pdf_doc_key", None)
+    st.session_state.pop("extracted_cache", None)
+    doc = st.session_state.pop("pdf_doc", None)
+    if doc is not None:
+        doc.close()
 
-    doc.close()
-    text = "\n\n".join(parts)
-    while "\n\n\n\n" in text:
-        text = text.replace("\n\n\n\n", "\n\n\n")
-    return text.strip()
+def get_pdf_doc(uploaded: UploadedFile) -> fitz.Document:
+    # Opening a document parses its xref table; keep the parsed document for the
+    # session instead of reopening it on every rerun and again for extraction.
+    # Keyed by the upload's file_id, so reruns (e.g. while polling a job) don't
+    # read or hash the PDF again.
+    key = uploaded.file_id
+    if st.session_state.get("pdf_doc_key") != key:
+        close_cached_pdf()
+        st.session_state["pdf_doc"] = fitz.open(stream=uploaded.getvalue(), filetype="pdf")
+        st.session_state["pdf_doc_key"] = key
+    return st.session_state["pdf_doc"]
 
 # ---------- Chunking ----------
+def _pack(pieces: List[str], seps: List[str], max_chars: int) -> List[str]:
+    # Greedily pack consecutive pieces into strings of at most max_chars (a single
+    # oversized piece stays on its own); seps[k] is what joins pieces[k] to the piece
+    # before it. Boundaries come from a prefix sum of len(sep) + len(piece) via
+    # searchsorted, so each output string is built with one join instead of growing
+    # a buffer piece by piece.
+    if not pieces:
+        return []
+    cum = np.cumsum(np.fromiter((len(sep) + len(p) for sep, p in zip(seps, pieces)),
+                                dtype=np.int64, count=len(pieces)))
+    packed: List[str] = []
+    start = 0
+    while start < len(pieces):
+        # The first piece of a string carries no separator.
+        limit = (int(cum[start - 1]) if start else 0) + len(seps[start]) + max_chars
+        end = max(int(np.searchsorted(cum, limit, side="right")), start + 1)
+        packed.append(pieces[start] + "".join(
+            itertools.chain.from_iterable(zip(seps[start + 1:end], pieces[start + 1:end]))))
+        start = end
+    return packed
+
 def split_into_chunks(text: str, max_chars: int = 4500) -> List[str]:
-    paras = [p.strip() for p in text.split("\n\n") if p.strip()]
-    chunks: List[str] = []
-    cur = ""
-    for p in paras:
+    # Paragraphs join with a blank line; paragraphs too long for one chunk are split
+    # into sentences joined with a space. Both kinds are packed in a single pass, so
+    # sentence pieces share chunks with their neighbouring paragraphs.
+    pieces: List[str] = []
+    seps: List[str] = []
+    for p in (p.strip() for p in text.split("\n\n")):
+        if not p:
+            continue
         if len(p) > max_chars:
-            sentences = p.replace("\n", " ").split(". ")
-            for s in sentences:
-                s2 = (s + ("" if s.endswith(".") else ".")).strip()
-                if len(cur) + 1 + len(s2) > max_chars:
-                    if cur:
-                        chunks.append(cur.strip())
-                    cur = s2
-                else:
-                    cur = (cur + " " + s2).strip()
+            for s in p.replace("\n", " ").split(". "):
+                pieces.append((s + ("" if s.endswith(".") else ".")).strip())
+                seps.append(" ")
         else:
-            if len(cur) + 2 + len(p) > max_chars:
-                if cur:
-                    chunks.append(cur.strip())
-                cur = p
-            else:
-                cur = (cur + "\n\n" + p).strip() if cur else p
-    if cur:
-        chunks.append(cur.strip())
-    return chunks
+            pieces.append(p)
+            seps.append("\n\n")
+    return _pack(pieces, seps, max_chars)
 
 # ---------- TTS (Edge TTS primary, gTTS fallback) ----------
+def get_tts_loop() -> asyncio.AbstractEventLoop:
+    # One event loop per browser session, reused across reruns and button clicks
+    # instead of creating and tearing down a loop with asyncio.run for every call.
+    loop = st.session_state.get("tts_loop")
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        st.session_state["tts_loop"] = loop
+    return loop
+
 async def synthesize_edge_async(text: str, voice_key: str) -> bytes:
     voice = EDGE_VOICE_MAP.get(voice_key, "en-US-JennyNeural")
     communicate = edge_tts.Communicate(text=text, voice=voice, rate="+0%", pitch="+0Hz")
@@ -119,37 +134,393 @@ async def synthesize_edge_async(text: str, voice_key: str) -> bytes:
             out.write(chunk["data"])
     return out.getvalue()
 
+# Edge TTS output is deterministic for a (text, voice) pair, so keep it on disk and
+# skip the network entirely on repeat conversions and previews.
+def _tts_cache_path(text: str, voice_key: str) -> Path:
+    key = hashlib.sha256((voice_key + "\0" + text).encode("utf-8")).hexdigest()
+    return TTS_CACHE_DIR / f"{key}.mp3"
+
+def tts_cache_get(text: str, voice_key: str) -> Optional[bytes]:
+    path = _tts_cache_path(text, voice_key)
+    try:
+        data = path.read_bytes()
+        os.utime(path)  # mtime doubles as "last used" for LRU eviction
+    except OSError:
+        return None
+    return data or None
+
+def tts_cache_put(text: str, voice_key: str, data: bytes) -> None:
+    path = _tts_cache_path(text, voice_key)
+    tmp_path = None
+    try:
+        TTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        # The cache is best-effort, but eviction only sees *.mp3, so don't leave the .tmp.
+        if tmp_path is not None:
+            _remove_file(tmp_path)
+
+def evict_tts_cache(max_bytes: int = TTS_CACHE_MAX_BYTES) -> None:
+    entries = []
+    for entry in TTS_CACHE_DIR.glob("*.mp3"):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda t: t[0]):
+        if total <= max_bytes:
+            break
+        try:
+            entry.unlink()
+            total -= size
+        except OSError:
+            pass
+
+async def synthesize_edge_cached_async(text: str, voice_key: str) -> bytes:
+    cached = tts_cache_get(text, voice_key)
+    if cached is not None:
+        return cached
+    audio_bytes = await synthesize_edge_async(text, voice_key)
+    if audio_bytes:
+        tts_cache_put(text, voice_key, audio_bytes)
+    return audio_bytes
+
+@functools.lru_cache(maxsize=None)
+def get_gtts_session() -> requests.Session:
+    # Shared keep-alive session so fallback chunks reuse one TLS connection. Cached
+    # with lru_cache, not st.cache_resource: it is only called from executor threads,
+    # which have no ScriptRunContext.
+    # gTTS sends with verify=False; silence urllib3's warning about it like gTTS does.
+    requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class PooledGTTS(gTTS):
+    # Same request/response handling as gTTS.stream() (2.5.x), which opens (and
+    # closes) a new requests.Session for every request; this sends through the shared
+    # one. Versions without the internals copied here use the stock implementation.
+    def stream(self):
+        if not hasattr(self, "_prepare_requests"):
+            yield from super().stream()
+            return
+        session = get_gtts_session()
+        for pr in self._prepare_requests():
+            try:
+                r = session.send(request=pr, verify=False, proxies=urllib.request.getproxies(),
+                                 timeout=self.timeout)
+                r.raise_for_status()
+            except requests.exceptions.HTTPError:
+                raise gTTSError(tts=self, response=r)
+            except requests.exceptions.RequestException:
+                raise gTTSError(tts=self)
+
+            for line in r.iter_lines(chunk_size=1024):
+                decoded_line = line.decode("utf-8")
+                if "jQ1olc" in decoded_line:
+                    audio_search = re.search(r'jQ1olc","\[\\"(.*)\\"]', decoded_line)
+                    if not audio_search:
+                        raise gTTSError(tts=self, response=r)
+                    yield base64.b64decode(audio_search.group(1).encode("ascii"))
+
+@functools.lru_cache(maxsize=None)
+def _gtts_tld(voice_key: str) -> str:
+    return "co.uk" if "British" in voice_key else "com"
+
 def synthesize_gtts(text: str, voice_key: str) -> bytes:
-    tld = "co.uk" if "British" in voice_key else "com"
-    tts = gTTS(text=text, lang="en", tld=tld, slow=False)
+    tts = PooledGTTS(text=text, lang="en", tld=_gtts_tld(voice_key), slow=False)
     bio = io.BytesIO()
     tts.write_to_fp(bio)
     bio.seek(0)
     return bio.read()
 
-def synthesize_segment_to_audiosegment(text: str, voice_key: str) -> AudioSegment:
+def _edge_result_or_gtts(text: str, voice_key: str, edge_result) -> Tuple[bytes, bool]:
+    # edge_result is either the Edge TTS MP3 bytes or the exception Edge raised.
+    # Returns (mp3_bytes, from_edge).
+    if isinstance(edge_result, bytes) and edge_result:
+        return edge_result, True
+    e = edge_result if isinstance(edge_result, Exception) else RuntimeError("no audio received")
     try:
-        audio_bytes = asyncio.run(synthesize_edge_async(text, voice_key))
-        return AudioSegment.from_file(io.BytesIO(audio_bytes), format="mp3")
+        return synthesize_gtts(text, voice_key), False
+    except Exception as e2:
+        raise RuntimeError(f"All TTS engines failed: Edge TTS error={e}; gTTS error={e2}")
+
+def synthesize_preview(text: str, voice_key: str,
+                       loop: Optional[asyncio.AbstractEventLoop] = None) -> bytes:
+    # Both engines return MP3, which st.audio plays as-is: no decode/re-encode needed.
+    loop = loop or get_tts_loop()
+    try:
+        edge_result = loop.run_until_complete(synthesize_edge_cached_async(text, voice_key))
     except Exception as e:
+        edge_result = e
+    evict_tts_cache()
+    audio_bytes, _ = _edge_result_or_gtts(text, voice_key, edge_result)
+    return audio_bytes
+
+async def synthesize_edge_batch_async(texts: List[str], voice_key: str,
+                                      on_done: Optional[Callable[[int], None]] = None) -> AsyncIterator:
+    # Edge TTS is network-bound, so run the chunks concurrently (capped to stay polite
+    # with the service). Results are yielded in input order as soon as each is ready;
+    # failures are yielded, not raised. on_done receives the index of each finished text.
+    # New requests start only as results are consumed, so a slow consumer holds back
+    # synthesis instead of finished audio piling up.
+    async def _one(i: int, text: str) -> bytes:
         try:
-            audio_bytes = synthesize_gtts(text, voice_key)
-            return AudioSegment.from_file(io.BytesIO(audio_bytes), format="mp3")
-        except Exception as e2:
-            raise RuntimeError(f"All TTS engines failed: Edge TTS error={e}; gTTS error={e2}")
+            return await synthesize_edge_cached_async(text, voice_key)
+        finally:
+            if on_done is not None:
+                on_done(i)
+
+    upcoming = iter(enumerate(texts))
+    in_flight: Deque[asyncio.Future] = deque()
+
+    def _start_more() -> None:
+        while len(in_flight) < EDGE_MAX_CONCURRENCY:
+            item = next(upcoming, None)
+            if item is None:
+                return
+            in_flight.append(asyncio.ensure_future(_one(*item)))
+
+    try:
+        _start_more()
+        while in_flight:
+            task = in_flight.popleft()
+            try:
+                result = await task
+            except Exception as e:
+                result = e
+            del task
+            _start_more()
+            yield result
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+# ---------- Audio assembly ----------
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def strip_id3(data: bytes) -> bytes:
+    # ID3v2 header: "ID3", version (2), flags (1), syncsafe size (4); optional 10-byte footer.
+    if len(data) < 10 or data[:3] != b"ID3":
+        return data
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    end = 10 + size + (10 if data[5] & 0x10 else 0)
+    return data[end:]
+
+def _new_mp3_encoder(frame_rate: int, channels: int, bitrate_kbps: int = 192) -> lameenc.Encoder:
+    # Encode in-process with LAME instead of AudioSegment.export, which pipes the PCM
+    # through an FFmpeg subprocess. Input is interleaved 16-bit PCM.
+    enc = lameenc.Encoder()
+    enc.set_bit_rate(bitrate_kbps)
+    enc.set_in_sample_rate(frame_rate)
+    enc.set_channels(channels)
+    enc.set_quality(2)
+    return enc
+
+class Mp3Assembler:
+    # Streams the book to an MP3 file as chunks arrive in book order. Edge TTS emits
+    # frame-aligned MP3 in one fixed format, so its chunks are appended byte-wise.
+    # A gTTS chunk (which may not match) is decoded on its own, resampled to the Edge
+    # format and LAME-encoded separately; its frames are appended the same way, so
+    # earlier audio is never decoded again. Re-encoded chunks are kept by key until
+    # release(key), so a repeated gTTS chunk is only decoded once.
+    def __init__(self, path: str):
+        self.path = path
+        self._out = open(path, "wb")
+        self._reencoded = {}
+
+    def add(self, key: int, data: bytes, from_edge: bool) -> None:
+        if not from_edge:
+            reencoded = self._reencoded.get(key)
+            if reencoded is None:
+                reencoded = self._reencoded[key] = self._reencode(data)
+            data = reencoded
+        self._out.write(data if self._out.tell() == 0 else strip_id3(data))
+
+    def release(self, key: int) -> None:
+        self._reencoded.pop(key, None)
+
+    @staticmethod
+    def _reencode(data: bytes) -> bytes:
+        seg = (AudioSegment.from_file(io.BytesIO(data), format="mp3")
+               .set_frame_rate(EDGE_OUTPUT_FRAME_RATE)
+               .set_channels(EDGE_OUTPUT_CHANNELS)
+               .set_sample_width(2))
+        enc = _new_mp3_encoder(EDGE_OUTPUT_FRAME_RATE, EDGE_OUTPUT_CHANNELS, EDGE_OUTPUT_BITRATE_KBPS)
+        return bytes(enc.encode(seg.raw_data) + enc.flush())
+
+    def finish(self) -> str:
+        self._out.close()
+        return self.path
+
+    def discard(self) -> None:
+        self._out.close()
+        _remove_file(self.path)
+
+# ---------- Export pipeline ----------
+async def _synthesize_to_mp3_file_async(texts: List[str], voice_key: str, assembler: Mp3Assembler,
+                                        on_done: Optional[Callable[[int], None]] = None) -> Optional[str]:
+    # Returns None, or a "chunk N: ..." message if every engine failed on chunk N; the
+    # chunks before it are still assembled, like the old serial loop's `break`.
+    loop = asyncio.get_running_loop()
+
+    # Repeated chunks (running headers, boilerplate) are synthesized once and their
+    # audio reused at every position.
+    unique_index = {}
+    positions: List[int] = []
+    for text in texts:
+        positions.append(unique_index.setdefault(text, len(unique_index)))
+    unique_texts = list(unique_index)
+    counts = Counter(positions)
+
+    def on_unique_done(j: int) -> None:
+        if on_done is not None:
+            on_done(counts[j])
+
+    # Producer: synthesized audio in order -> bounded queue -> consumer assembling the
+    # book on a worker thread, so decoding/joining overlaps with the network I/O.
+    audio_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    async def produce() -> Optional[str]:
+        j = 0
+        tts_error = None
+        edge_results = synthesize_edge_batch_async(unique_texts, voice_key, on_unique_done)
+        try:
+            async for edge_result in edge_results:
+                try:
+                    # The gTTS fallback blocks on HTTP; keep it off the event loop.
+                    result = await loop.run_in_executor(None, _edge_result_or_gtts,
+                                                        unique_texts[j], voice_key, edge_result)
+                except RuntimeError as e:
+                    tts_error = f"chunk {positions.index(j) + 1}: {e}"
+                    break
+                await audio_queue.put(result)
+                j += 1
+        finally:
+            await edge_results.aclose()  # cancels requests still in flight after a break
+        await audio_queue.put(None)
+        return tts_error
+
+    last_use = {j: pos for pos, j in enumerate(positions)}
+
+    def add_all(items: List[Tuple[int, bytes, bool, bool]]) -> None:
+        for j, data, from_edge, is_last_use in items:
+            assembler.add(j, data, from_edge)
+            if is_last_use:
+                assembler.release(j)
+
+    async def consume() -> None:
+        # Audio is held only until the last chunk position that repeats it.
+        unique_results: List[Optional[Tuple[bytes, bool]]] = []
+        next_pos = 0
+        while True:
+            result = await audio_queue.get()
+            if result is None:
+                return
+            unique_results.append(result)
+            # Emit every chunk whose audio is now available, in book order.
+            ready = []
+            while next_pos < len(positions) and positions[next_pos] < len(unique_results):
+                j = positions[next_pos]
+                is_last_use = last_use[j] == next_pos
+                ready.append((j,) + unique_results[j] + (is_last_use,))
+                if is_last_use:
+                    unique_results[j] = None
+                next_pos += 1
+            adding = loop.run_in_executor(None, add_all, ready)
+            try:
+                await asyncio.shield(adding)
+            except asyncio.CancelledError:
+                # Never leave a thread writing to the file after we return.
+                await asyncio.wait([adding])
+                raise
+
+    producer = asyncio.ensure_future(produce())
+    consumer = asyncio.ensure_future(consume())
+    try:
+        tts_error, _ = await asyncio.gather(producer, consumer)
+    finally:
+        producer.cancel()
+        consumer.cancel()
+        await asyncio.gather(producer, consumer, return_exceptions=True)
+    return tts_error
+
+def synthesize_to_mp3_file(texts: List[str], voice_key: str,
+                           on_done: Optional[Callable[[int], None]] = None,
+                           loop: Optional[asyncio.AbstractEventLoop] = None) -> Tuple[str, Optional[str]]:
+    # Returns (path, tts_error): the path of a temporary MP3 file, which the caller owns
+    # (and removes), and the chunk failure that cut the book short, if any.
+    # on_done receives how many of `texts` a finished synthesis covers.
+    loop = loop or get_tts_loop()
+    fd, path = tempfile.mkstemp(prefix="audiobook_", suffix=".mp3")
+    os.close(fd)
+    assembler = Mp3Assembler(path)
+    try:
+        tts_error = loop.run_until_complete(_synthesize_to_mp3_file_async(texts, voice_key, assembler, on_done))
+        return assembler.finish(), tts_error
+    except BaseException:
+        assembler.discard()
+        raise
+    finally:
+        evict_tts_cache()
+
+# ---------- Background TTS jobs ----------
+def get_tts_executor() -> ThreadPoolExecutor:
+    # A single worker per session: it owns the session's TTS event loop, so the loop
+    # is only ever driven from one thread while the script thread keeps the UI live.
+    executor = st.session_state.get("executor")
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+        st.session_state["executor"] = executor
+    return executor
+
+class ExportedAudio:
+    # A finished export on disk. The file is removed by discard(), or when the object is
+    # garbage-collected along with its session state once the browser session ends.
+    def __init__(self, path: str, filename: str):
+        self.path = path
+        self.filename = filename
+        self._finalizer = weakref.finalize(self, _remove_file, path)
+
+    def discard(self) -> None:
+        self._finalizer()
+
+def set_full_audio(audio: Optional[ExportedAudio]) -> None:
+    previous = st.session_state.get("full_audio")
+    if previous is not None and previous is not audio:
+        previous.discard()
+    st.session_state["full_audio"] = audio
+
+def on_upload_change() -> None:
+    close_cached_pdf()
+    st.session_state.pop("preview_audio", None)
+    set_full_audio(None)
+
+def run_export_job(chunks: List[str], voice_key: str, loop: asyncio.AbstractEventLoop,
+                   events: "queue.Queue[int]") -> Tuple[str, Optional[str]]:
+    # Runs on the executor thread: no Streamlit calls here, progress goes through `events`.
+    return synthesize_to_mp3_file(chunks, voice_key, on_done=events.put, loop=loop)
 
 # ---------- UI ----------
-uploaded = st.file_uploader("Upload a PDF file", type=["pdf"])
+uploaded = st.file_uploader("Upload a PDF file", type=["pdf"], on_change=on_upload_change)
 voice = st.selectbox("Choose Voice", VOICE_KEYS, index=1)
 
 page_range_opt = st.checkbox("Select a page range (optional)")
 start_page = end_page = None
 if uploaded:
     try:
-        tmp_doc = fitz.open(stream=uploaded.read(), filetype="pdf")
-        total_pages = len(tmp_doc)
-        tmp_doc.close()
-        uploaded.seek(0)
+        total_pages = len(get_pdf_doc(uploaded))
     except Exception as e:
         st.error(f"Error reading PDF: {e}")
         total_pages = None
@@ -185,56 +556,119 @@ if do_extract:
         st.error("Please upload a PDF first.")
     else:
         show_engine_banner()
-        pdf_bytes = uploaded.read()
-        uploaded.seek(0)
-        with st.spinner("Extracting text..."):
-            text = extract_text_preserving_structure(pdf_bytes, start_page, end_page)
-            st.session_state["extracted_text"] = text
+        pdf_bytes = uploaded.getvalue()
+        doc = get_pdf_doc(uploaded)
+        # Re-clicking with the same PDF and page range reuses the earlier extraction.
+        extracted_cache = st.session_state.setdefault("extracted_cache", {})
+        cache_key = (st.session_state["pdf_doc_key"],) + normalize_page_range(len(doc), start_page, end_page)
+        text = extracted_cache.get(cache_key)
+        if text is None:
+            extract_progress = st.progress(0)
+
+            def on_page_done(i, n):
+                extract_progress.progress(int(i * 100 / n), text=f"Extracting text: page {i}/{n}")
+
+            text = extract_text_preserving_structure(doc, start_page, end_page, on_page=on_page_done,
+                                                     pdf_bytes=pdf_bytes)
+            extract_progress.empty()
+            extracted_cache[cache_key] = text
+        st.session_state["extracted_text"] = text
 
         if not text.strip():
             st.error("No extractable text found in the selected pages.")
         else:
             st.success("Text extracted! Generating preview...")
             preview_text = text[:1500]
-            try:
-                seg = synthesize_segment_to_audiosegment(preview_text, voice)
-                bio = io.BytesIO()
-                seg.export(bio, format="mp3", bitrate="192k")
-                bio.seek(0)
-                st.session_state["preview_audio"] = bio.read()
-                st.audio(st.session_state["preview_audio"], format="audio/mp3")
-                st.caption("Preview generated from the first part of your document.")
-            except Exception as e:
-                st.error(f"TTS preview failed: {e}")
+            # Polled below like the export, so a running export never blocks the UI.
+            st.session_state["preview_audio"] = None
+            st.session_state["preview_job"] = get_tts_executor().submit(
+                synthesize_preview, preview_text, voice, get_tts_loop()
+            )
 
 if do_export:
     if not st.session_state["extracted_text"]:
         st.error("Please run **Extract & Preview** first.")
+    elif st.session_state.get("export_job") is not None:
+        st.warning("An export is already running.")
     else:
         show_engine_banner()
         text = st.session_state["extracted_text"]
         chunks = split_into_chunks(text, max_chars=4500)
+        events: "queue.Queue[int]" = queue.Queue()
+        st.session_state["export_job"] = {
+            "future": get_tts_executor().submit(run_export_job, chunks, voice, get_tts_loop(), events),
+            "events": events,
+            "done": 0,
+            "total": len(chunks),
+            "filename": (uploaded.name.rsplit(".", 1)[0] if uploaded else "audiobook") + ".mp3",
+        }
 
-        progress = st.progress(0)
-        status = st.empty()
-        combined = AudioSegment.silent(duration=0)
+# Poll background jobs: show their state, then rerun until they finish.
+jobs_pending = False
 
-        for i, ch in enumerate(chunks, start=1):
-            status.text(f"Generating audio {i}/{len(chunks)}...")
-            try:
-                seg = synthesize_segment_to_audiosegment(ch, voice)
-            except Exception as e:
-                st.error(f"TTS failed on chunk {i}: {e}")
-                break
-            combined += seg
-            progress.progress(int(i * 100 / len(chunks)))
-
-        if len(combined) > 0:
-            filename = (uploaded.name.rsplit(".", 1)[0] if uploaded else "audiobook") + ".mp3"
-            bio = io.BytesIO()
-            combined.export(bio, format="mp3", bitrate="192k")
-            bio.seek(0)
-            st.session_state["full_audio"] = bio.read()
-            st.success("Audiobook ready!")
-            st.download_button("⬇️ Download MP3", data=st.session_state["full_audio"], file_name=filename, mime="audio/mpeg")
-            st.caption("Tip: If export fails, ensure FFmpeg is installed and on your PATH.")
+preview_job = st.session_state.get("preview_job")
+if preview_job is not None:
+    if not preview_job.done():
+        if st.session_state.get("export_job") is not None:
+            st.info("Preview will be generated once the running export finishes.")
+        else:
+            st.info("Generating preview...")
+        jobs_pending = True
+    else:
+        st.session_state["preview_job"] = None
+        try:
+            st.session_state["preview_audio"] = preview_job.result()
+        except Exception as e:
+            st.error(f"TTS preview failed: {e}")
+
+if st.session_state["preview_audio"]:
+    st.audio(st.session_state["preview_audio"], format="audio/mp3")
+    st.caption("Preview generated from the first part of your document.")
+
+export_job = st.session_state.get("export_job")
+export_finished = False
+if export_job is not None:
+    while True:
+        try:
+            export_job["done"] += export_job["events"].get_nowait()
+        except queue.Empty:
+            break
+    done, total = export_job["done"], export_job["total"]
+
+    if not export_job["future"].done():
+        st.progress(int(done * 100 / max(total, 1)), text=f"Generating audio {done}/{total}...")
+        jobs_pending = True
+    else:
+        st.session_state["export_job"] = None
+        export_finished = True
+        full_audio_path, tts_error = None, None
+        try:
+            full_audio_path, tts_error = export_job["future"].result()
+        except Exception as e:
+            st.error(f"Export failed: {e}")
+        if tts_error:
+            st.error(f"TTS failed on {tts_error}")
+
+        if full_audio_path and os.path.getsize(full_audio_path) > 0:
+            set_full_audio(ExportedAudio(full_audio_path, export_job["filename"]))
+            if tts_error:
+                st.warning("Exported the audio generated before the failed chunk.")
+            else:
+                st.success("Audiobook ready!")
+        else:
+            if full_audio_path:
+                _remove_file(full_audio_path)
+            set_full_audio(None)
+
+# download_button reads the whole file into Streamlit's media store, so skip it on the
+# poll reruns of another pending job (except the one where this export finished).
+full_audio = st.session_state["full_audio"]
+show_download = export_finished or not jobs_pending
+if show_download and full_audio is not None and os.path.exists(full_audio.path):
+    with open(full_audio.path, "rb") as f:
+        st.download_button("⬇️ Download MP3", data=f, file_name=full_audio.filename, mime="audio/mpeg")
+    st.caption("Tip: If export fails, ensure FFmpeg is installed and on your PATH.")
+
+if jobs_pending:
+    time.sleep(EXPORT_POLL_SECONDS)
+    st.rerun()
@@ -0,0 +1,238 @@
+# pdf_extract.py
+# PDF text extraction (headings & paragraphs preserved heuristically) for app.py.
+# Kept free of Streamlit so extraction workers can import it in child processes.
+
+import io
+import os
+import re
+import sys
+import types
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import fitz  # PyMuPDF
+
+_EXCESS_BLANK_LINES_RE = re.compile(r"\n{4,}")
+HEADING_MAX_CHARS = 120  # longer blocks are never treated as headings
+HEADER_THRESHOLD_SAMPLE_PAGES = 5  # pages sampled before reusing a document-wide threshold
+HEADER_THRESHOLD_SAMPLE_MAX_PAGES = 50  # sampling gives up after this many pages of a range
+HEADER_THRESHOLD_MAX_VARIANCE = 0.01
+# Under `streamlit run` a spawned worker takes ~0.7 s until it can take work, while a
+# text page extracts in ~1 ms, so a worker only pays off with about a thousand pages.
+PARALLEL_MIN_PAGES_PER_WORKER = 1000
+PARALLEL_MIN_PAGES_PER_TASK = 8
+PARALLEL_MAX_WORKERS = 8
+
+def _header_threshold(spansizes: List[float]) -> float:
+    # 75th-percentile font size; np.partition selects it in O(n) without a full sort.
+    if not spansizes:
+        return 16.0
+    sizes = np.asarray(spansizes, dtype=np.float32)
+    k = int(0.75 * len(sizes))
+    return float(np.partition(sizes, k)[k])
+
+def _document_header_threshold(sampled: List[float]) -> Optional[float]:
+    # Once the first sampled pages agree, the document's font pattern is uniform and
+    # their threshold is reused instead of recomputing it for every page.
+    if len(sampled) < HEADER_THRESHOLD_SAMPLE_PAGES:
+        return None
+    sample = np.asarray(sampled[:HEADER_THRESHOLD_SAMPLE_PAGES], dtype=np.float32)
+    if float(np.var(sample)) >= HEADER_THRESHOLD_MAX_VARIANCE:
+        return None
+    return float(sample.mean())
+
+def _settle_sample(sampled_thresholds: Optional[List[float]], pages_read: int) -> Optional[List[float]]:
+    # None once the sample can no longer complete; every later page then uses its own
+    # threshold. Only heading pages are sampled, so body-heavy books may never fill it.
+    if (sampled_thresholds is not None and len(sampled_thresholds) < HEADER_THRESHOLD_SAMPLE_PAGES
+            and pages_read >= HEADER_THRESHOLD_SAMPLE_MAX_PAGES):
+        return None
+    return sampled_thresholds
+
+def _page_text_from_dict(page: fitz.Page, sampled_thresholds: Optional[List[float]]) -> str:
+    pdata = page.get_text("dict")
+
+    header_threshold = None
+    if sampled_thresholds is not None:
+        header_threshold = _document_header_threshold(sampled_thresholds)
+    if header_threshold is None:
+        spansizes = []
+        for block in pdata.get("blocks", []):
+            for line in block.get("lines", []):
+                for span in line.get("spans", []):
+                    size = span.get("size", 0)
+                    if size:
+                        spansizes.append(size)
+        header_threshold = _header_threshold(spansizes)
+        if spansizes and sampled_thresholds is not None:
+            sampled_thresholds.append(header_threshold)
+
+    page_parts: List[str] = []
+    for block in pdata.get("blocks", []):
+        text_buf = []
+        max_size = 0.0
+        for line in block.get("lines", []):
+            line_text = "".join(span.get("text", "") for span in line.get("spans", []))
+            line_text = line_text.replace("\r", "").strip()
+            if line_text:
+                text_buf.append(line_text)
+            for span in line.get("spans", []):
+                if span.get("size", 0) > max_size:
+                    max_size = span["size"]
+        if not text_buf:
+            continue
+
+        block_text = " ".join(text_buf).strip()
+        if not block_text:
+            continue
+
+        if max_size >= header_threshold and len(block_text) <= HEADING_MAX_CHARS:
+            page_parts.append(f"# {block_text}")
+        else:
+            page_parts.append(block_text)
+
+    return "\n\n".join(page_parts)
+
+def _page_text(page: fitz.Page, sampled_thresholds: Optional[List[float]]) -> str:
+    # "blocks" mode skips building the span/font tree, which is most of the cost of
+    # "dict" mode. Font sizes are only needed to mark headings, so estimate each
+    # block's per-line height from its bbox and only take the "dict" path on pages
+    # where a block short enough to be a heading has taller lines than the page
+    # median. Body line pitch includes leading, so a heading one or two points above
+    # the body size only beats the median, not a fixed ratio of it.
+    block_texts: List[str] = []
+    line_heights: List[float] = []
+    heading_candidates: List[float] = []
+    for _x0, y0, _x1, y1, raw_text, _block_no, block_type in page.get_text("blocks"):
+        if block_type != 0:  # image block
+            continue
+        lines = [ln.strip() for ln in raw_text.replace("\r", "").split("\n")]
+        lines = [ln for ln in lines if ln]
+        if not lines:
+            continue
+        block_text = " ".join(lines)
+        block_texts.append(block_text)
+        line_heights.append((y1 - y0) / len(lines))
+        if len(block_text) <= HEADING_MAX_CHARS:
+            heading_candidates.append(line_heights[-1])
+
+    if heading_candidates:
+        median_height = sorted(line_heights)[(len(line_heights) - 1) // 2]  # lower median
+        if max(heading_candidates) > median_height:
+            return _page_text_from_dict(page, sampled_thresholds)
+    return "\n\n".join(block_texts)
+
+def normalize_page_range(n_pages: int, page_start: int = None, page_end: int = None) -> Tuple[int, int]:
+    if page_start is None:
+        page_start = 1
+    if page_end is None or page_end > n_pages:
+        page_end = n_pages
+    page_start = max(1, page_start)
+    page_end = max(page_start, min(n_pages, page_end))
+    return page_start, page_end
+
+def iter_page_texts(doc: fitz.Document, page_start: int, page_end: int) -> Iterator[str]:
+    # 1-based, inclusive page range (see normalize_page_range).
+    sampled_thresholds: Optional[List[float]] = []
+    for pages_read, pno in enumerate(range(page_start - 1, page_end)):
+        sampled_thresholds = _settle_sample(sampled_thresholds, pages_read)
+        yield _page_text(doc[pno], sampled_thresholds)
+
+def _usable_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _parallel_workers(n_pages: int) -> int:
+    return min(_usable_cpus(), PARALLEL_MAX_WORKERS, n_pages // PARALLEL_MIN_PAGES_PER_WORKER)
+
+_worker_doc: Optional[fitz.Document] = None
+
+def _init_worker(pdf_bytes: bytes) -> None:
+    # Runs once per worker process, so the PDF is sent and opened once per worker
+    # rather than once per sub-range (fitz.Document can't be pickled).
+    global _worker_doc
+    _worker_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+def _extract_pages(page_start: int, page_end: int, sampled_thresholds: Optional[List[float]]) -> str:
+    return "\n\n".join(_page_text(_worker_doc[pno], sampled_thresholds)
+                       for pno in range(page_start - 1, page_end))
+
+_spawn_lock = threading.Lock()
+
+@contextlib.contextmanager
+def _main_without_file() -> Iterator[None]:
+    # Spawned children re-import the parent's __main__ from its __file__. Under
+    # `streamlit run` that is app.py, so every worker would run the whole script
+    # (and import streamlit, edge_tts, ...). Workers started inside this block see
+    # a bare __main__ instead and only import this module.
+    with _spawn_lock:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            yield
+        finally:
+            sys.modules["__main__"] = main
+
+def _iter_parallel_range_texts(doc: fitz.Document, pdf_bytes: bytes, page_start: int, page_end: int,
+                               workers: int) -> Iterator[Tuple[int, str]]:
+    # Yields (pages_in_range, text) per sub-range, in page order. Pages are read here
+    # until the header-threshold sample is settled (complete, or abandoned after
+    # HEADER_THRESHOLD_SAMPLE_MAX_PAGES); every sub-range then starts from that same
+    # state, which keeps the output identical to a serial pass.
+    sampled_thresholds: Optional[List[float]] = []
+    pno = page_start
+    while pno <= page_end:
+        sampled_thresholds = _settle_sample(sampled_thresholds, pno - page_start)
+        if sampled_thresholds is None or len(sampled_thresholds) >= HEADER_THRESHOLD_SAMPLE_PAGES:
+            break
+        yield 1, _page_text(doc[pno - 1], sampled_thresholds)
+        pno += 1
+    if pno > page_end:
+        return
+    if sampled_thresholds is not None:
+        sampled_thresholds = sampled_thresholds[:HEADER_THRESHOLD_SAMPLE_PAGES]
+
+    n_pages = page_end - pno + 1
+    # A few sub-ranges per worker keeps the cores busy and progress reasonably fine-grained.
+    step = max(PARALLEL_MIN_PAGES_PER_TASK, -(-n_pages // (workers * 4)))
+    ranges = [(s, min(s + step - 1, page_end)) for s in range(pno, page_end + 1, step)]
+    # "spawn" rather than fork: the Streamlit server process is multi-threaded.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(pdf_bytes,)) as pool:
+        # Workers are started from submit(), at most one per task.
+        with _main_without_file():
+            futures = [pool.submit(_extract_pages, s, e, sampled_thresholds) for s, e in ranges]
+        for (s, e), future in zip(ranges, futures):
+            yield e - s + 1, future.result()
+
+def extract_text_preserving_structure(doc: fitz.Document, page_start: int = None, page_end: int = None,
+                                      on_page: Optional[Callable[[int, int], None]] = None,
+                                      pdf_bytes: Optional[bytes] = None) -> str:
+    # With pdf_bytes, large ranges are extracted across processes (pages are independent
+    # and extraction is CPU-bound); otherwise pages are read from `doc` in this process.
+    page_start, page_end = normalize_page_range(len(doc), page_start, page_end)
+    n_pages = page_end - page_start + 1
+
+    workers = _parallel_workers(n_pages) if pdf_bytes is not None else 0
+    if workers > 1:
+        range_texts = _iter_parallel_range_texts(doc, pdf_bytes, page_start, page_end, workers)
+    else:
+        range_texts = ((1, t) for t in iter_page_texts(doc, page_start, page_end))
+
+    out = io.StringIO()
+    done = 0
+    for pages, range_text in range_texts:
+        if done:
+            out.write("\n\n")
+        out.write(range_text)
+        done += pages
+        if on_page is not None:
+            on_page(done, n_pages)
+
+    text = _EXCESS_BLANK_LINES_RE.sub("\n\n\n", out.getvalue())
+    return text.strip()